@@ -0,0 +1,266 @@
+"""Admission control for the upstream workers.
+
+Each upstream gets a daily quota, a concurrency cap and a priority queue.
+The counters live in the serving process, so under N gunicorn/uvicorn
+workers every process gets 1/N of the configured quota and concurrency
+(N comes from ADMISSION_PROCESSES, falling back to WEB_CONCURRENCY). This
+assumes the front server spreads load roughly evenly across processes.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
+
+
+# Lower number runs first
+INTERACTIVE = 0
+BULK = 10
+
+
+class AdmissionRefused(Exception):
+    status_code = 503
+
+    def __init__(self, worker, message, retry_after):
+        super().__init__(message)
+        self.worker = worker
+        self.message = message
+        self.retry_after = max(1, int(retry_after))
+
+
+class QuotaExceeded(AdmissionRefused):
+    status_code = 429
+
+
+class UpstreamBusy(AdmissionRefused):
+    status_code = 503
+
+
+def _next_utc_midnight(now):
+    tomorrow = now.date() + timedelta(days=1)
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=timezone.utc)
+
+
+# -----------------------------
+# PER-WORKER LIMITER
+# -----------------------------
+class UpstreamLimiter:
+    """Daily quota, concurrency cap and priority queue for one upstream worker.
+
+    Requests that can't possibly be served (quota spent, queue full) are
+    refused immediately; the rest wait in priority order for a free slot,
+    but never longer than max_wait seconds.
+    """
+
+    def __init__(self, name, daily_quota, max_concurrent, max_queue=32, max_wait=10.0, exhaust_seconds=900.0):
+        self.name = name
+        self.daily_quota = daily_quota
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.exhaust_seconds = exhaust_seconds
+
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._async_wakers = {}
+        self._seq = itertools.count()
+        self._active = 0
+        self._used = 0
+        self._exhausted_until = None
+        self._reset_at = _next_utc_midnight(datetime.now(timezone.utc))
+        self.refused = 0
+
+    def _roll_window(self):
+        now = datetime.now(timezone.utc)
+        if now >= self._reset_at:
+            self._used = 0
+            self._exhausted_until = None
+            self._reset_at = _next_utc_midnight(now)
+        if self._exhausted_until is not None and now >= self._exhausted_until:
+            self._exhausted_until = None
+
+    def _seconds_until_reset(self):
+        return (self._reset_at - datetime.now(timezone.utc)).total_seconds()
+
+    def _check_quota(self, pending):
+        if self._exhausted_until is not None:
+            self.refused += 1
+            raise QuotaExceeded(
+                self.name,
+                f"The {self.name} worker reported its quota as spent",
+                (self._exhausted_until - datetime.now(timezone.utc)).total_seconds(),
+            )
+        if self._used + pending >= self.daily_quota:
+            self.refused += 1
+            raise QuotaExceeded(
+                self.name,
+                f"Daily quota for the {self.name} worker has been reached",
+                self._seconds_until_reset(),
+            )
+
+    def _notify(self):
+        self._cond.notify_all()
+        for wake in self._async_wakers.values():
+            wake()
+
+    def _enqueue(self, priority):
+        # Called with the lock held; returns None if a slot is free right now
+        self._roll_window()
+        self._check_quota(len(self._waiting))
+
+        if self._active < self.max_concurrent and not self._waiting:
+            return None
+
+        if len(self._waiting) >= self.max_queue:
+            self.refused += 1
+            raise UpstreamBusy(self.name, f"The {self.name} worker is busy", 1)
+
+        ticket = (priority, next(self._seq))
+        heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _is_turn(self, ticket):
+        return self._waiting[0] == ticket and self._active < self.max_concurrent
+
+    def _dequeue(self, ticket):
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        self._async_wakers.pop(ticket, None)
+        self._notify()
+
+    def _timed_out(self):
+        self.refused += 1
+        return UpstreamBusy(self.name, f"The {self.name} worker is busy", self.max_wait)
+
+    def _admit(self, ticket):
+        if ticket is not None:
+            # Quota may have run out while we were queued
+            self._roll_window()
+            self._check_quota(0)
+        self._active += 1
+        self._used += 1
+
+    def acquire(self, priority=BULK):
+        with self._cond:
+            ticket = self._enqueue(priority)
+            if ticket is not None:
+                deadline = time.monotonic() + self.max_wait
+                try:
+                    while not self._is_turn(ticket):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._timed_out()
+                        self._cond.wait(remaining)
+                finally:
+                    self._dequeue(ticket)
+            self._admit(ticket)
+
+    async def acquire_async(self, priority=BULK):
+        # Same as acquire(), but queued callers wait on the event loop
+        # instead of parking a thread
+        loop = asyncio.get_running_loop()
+        turn = asyncio.Event()
+
+        with self._cond:
+            ticket = self._enqueue(priority)
+            if ticket is None:
+                self._admit(None)
+                return
+            self._async_wakers[ticket] = lambda: loop.call_soon_threadsafe(turn.set)
+
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while True:
+                turn.clear()
+                with self._cond:
+                    if self._is_turn(ticket):
+                        queued, ticket = ticket, None
+                        self._dequeue(queued)
+                        self._admit(queued)
+                        return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._cond:
+                        raise self._timed_out()
+                try:
+                    await asyncio.wait_for(turn.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if ticket is not None:
+                with self._cond:
+                    self._dequeue(ticket)
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._notify()
+
+    @contextmanager
+    def slot(self, priority=BULK):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def async_slot(self, priority=BULK):
+        await self.acquire_async(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def exhaust(self):
+        # The upstream told us it is out of quota; back off for a while rather
+        # than the rest of the day, since one odd reply shouldn't cost 24h
+        with self._cond:
+            now = datetime.now(timezone.utc)
+            self._exhausted_until = min(now + timedelta(seconds=self.exhaust_seconds), self._reset_at)
+            self._notify()
+
+    def stats(self):
+        with self._cond:
+            self._roll_window()
+            return {
+                "active": self._active,
+                "queued": len(self._waiting),
+                "used_today": self._used,
+                "daily_quota": self.daily_quota,
+                "exhausted": self._exhausted_until is not None,
+                "refused": self.refused,
+                "reset_in": int(self._seconds_until_reset()),
+            }
+
+
+# Serving processes sharing the configured limits; see the module docstring
+PROCESSES = max(1, int(os.getenv("ADMISSION_PROCESSES", os.getenv("WEB_CONCURRENCY", 1))))
+
+
+def _limiter_from_env(name, daily_quota, max_concurrent):
+    prefix = name.upper()
+    daily_quota = int(os.getenv(f"{prefix}_WORKER_DAILY_QUOTA", daily_quota))
+    max_concurrent = int(os.getenv(f"{prefix}_WORKER_MAX_CONCURRENT", max_concurrent))
+    return UpstreamLimiter(
+        name,
+        daily_quota=daily_quota // PROCESSES,
+        max_concurrent=max(1, max_concurrent // PROCESSES),
+        max_queue=int(os.getenv(f"{prefix}_WORKER_MAX_QUEUE", 32)),
+        max_wait=float(os.getenv(f"{prefix}_WORKER_MAX_WAIT", 10)),
+        exhaust_seconds=float(os.getenv(f"{prefix}_WORKER_EXHAUST_SECONDS", 900)),
+    )
+
+
+LIMITERS = {
+    "text": _limiter_from_env("text", 10000, 8),
+    "image": _limiter_from_env("image", 2000, 4),
+    "vision": _limiter_from_env("vision", 500, 4),
+}
+
+
+def all_stats():
+    return {name: limiter.stats() for name, limiter in LIMITERS.items()}
@@ -4,24 +4,32 @@ from mlconjug3 import Conjugator
 from sqlalchemy import create_engine, text
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
-import sqlite3, base64
+import base64, re
 
 import requests
 from flask import current_app
 conjugator = Conjugator(language="es")
 
+# mlconjug3 3.x keys tenses by their full "Mood tense" name
 TENSE_MAP = {
-    "present":      ("Indicativo", "Presente"),
-    "preterite":    ("Indicativo", "Pretérito perfecto simple"),
-    "imperfect":    ("Indicativo", "Pretérito imperfecto"),
-    "future":       ("Indicativo", "Futuro"),
-    "conditional":  ("Indicativo", "Condicional"),
-    "subjunctive":  ("Subjuntivo", "Presente"),
+    "present":      ("Indicativo", "Indicativo presente"),
+    "preterite":    ("Indicativo", "Indicativo pretérito perfecto simple"),
+    "imperfect":    ("Indicativo", "Indicativo pretérito imperfecto"),
+    "future":       ("Indicativo", "Indicativo futuro"),
+    "conditional":  ("Condicional", "Condicional Condicional"),
+    "subjunctive":  ("Subjuntivo", "Subjuntivo presente"),
 }
-from flask import Flask, request, jsonify, send_file, make_response
+from flask import Flask, request, jsonify, send_file, make_response, g, Response
 from flask_cors import CORS
 
 from recipe_generator import *
+from singleflight import group as flight_group, normalize_key, all_stats as flight_stats
+from storage import init_db, get_next_user_id, save_recipe
+import storage
+from admission import LIMITERS, AdmissionRefused, INTERACTIVE, BULK, all_stats as admission_stats
+import metrics
+from metrics import span
+import hmac, time
 
 app = Flask(__name__)
 
@@ -29,7 +37,26 @@ app.config['SPOTIFY_CLIENT_ID'] = os.getenv('SPOTIFY_CLIENT_ID')
 app.config['SPOTIFY_CLIENT_SECRET'] = os.getenv('SPOTIFY_CLIENT_SECRET')
 app.config['SPOTIFY_SHOW_ID'] = "7C7zL1MoVdOjUgxQyhO6rQ"
 CORS(app)
-DB_PATH = "recipes.db"
+
+@app.errorhandler(AdmissionRefused)
+def admission_refused(e):
+    response = jsonify({"error": e.message, "worker": e.worker, "retry_after": e.retry_after})
+    response.status_code = e.status_code
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # Label by route pattern, not raw path, to keep the series count bounded
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe_request(request.method, endpoint, response.status_code, time.perf_counter() - started)
+    return response
 
 @app.route("/")
 def home():
@@ -87,13 +114,90 @@ def conjugate():
         return jsonify({"error": f"Unknown tense '{tense}'"}), 400
 
     try:
-        result = conjugator.conjugate(verb)
+        result = flight_group("conjugate").do(normalize_key(verb), conjugator.conjugate, verb)
         mood_key, tense_key = TENSE_MAP[tense]
         conjugated = result[mood_key][tense_key]
         return jsonify({"verb": verb, "tense": tense, "conjugations": conjugated})
     except Exception as e:
         return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
 
+@app.route('/coalesce_stats', methods=['GET'])
+def coalesce_stats():
+    return jsonify(flight_stats())
+
+@app.route('/upstream_stats', methods=['GET'])
+def upstream_stats():
+    return jsonify(admission_stats())
+
+@metrics.register_collector
+def collect_app_gauges():
+    flights = flight_stats()
+    workers = admission_stats()
+    lines = []
+    lines += metrics.render_family(
+        "foodgen_singleflight_calls_total", "counter", "Upstream calls actually made per coalescing group.",
+        [({"group": name}, s["calls"]) for name, s in flights.items()])
+    lines += metrics.render_family(
+        "foodgen_singleflight_coalesced_total", "counter", "Requests that shared another request's call.",
+        [({"group": name}, s["coalesced"]) for name, s in flights.items()])
+    lines += metrics.render_family(
+        "foodgen_singleflight_in_flight", "gauge", "Coalesced calls currently running.",
+        [({"group": name}, s["in_flight"]) for name, s in flights.items()])
+    for key, metric_type, help_text in [
+        ("active", "gauge", "Upstream calls currently holding a worker slot."),
+        ("queued", "gauge", "Requests waiting for a worker slot."),
+        ("used_today", "gauge", "Upstream calls admitted in the current quota window."),
+        ("daily_quota", "gauge", "Configured daily quota."),
+        ("refused", "counter", "Requests refused by admission control."),
+    ]:
+        name = f"foodgen_worker_{key}" + ("_total" if metric_type == "counter" else "")
+        lines += metrics.render_family(name, metric_type, help_text,
+                                       [({"worker": w}, s[key]) for w, s in workers.items()])
+
+    pool = storage.engine.pool
+    if hasattr(pool, "checkedout"):
+        lines += metrics.render_family(
+            "foodgen_db_pool_checked_out", "gauge", "Database connections currently in use.",
+            [({}, pool.checkedout())])
+    return lines
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN")
+PROFILER_WRITE_ACTIONS = ("start", "stop", "reset")
+
+@app.route('/profiler', methods=['GET', 'POST'])
+def profiler_control():
+    # Only available when PROFILER_TOKEN is configured; the token travels in
+    # a header so it stays out of access logs
+    token = request.headers.get("X-Profiler-Token", "")
+    if not PROFILER_TOKEN or not hmac.compare_digest(token, PROFILER_TOKEN):
+        return jsonify({"error": "Profiler disabled"}), 403
+
+    action = request.values.get("action", "status")
+    if action in PROFILER_WRITE_ACTIONS and request.method != "POST":
+        return jsonify({"error": f"Use POST to {action} the profiler"}), 405
+
+    profiler = metrics.profiler
+    if action == "start":
+        try:
+            interval = float(request.values.get("interval", 0.01))
+        except ValueError:
+            return jsonify({"error": "interval must be a number"}), 400
+        profiler.start(max(0.001, interval))
+    elif action == "stop":
+        profiler.stop()
+    elif action == "reset":
+        profiler.reset()
+    elif action == "dump":
+        return Response(profiler.collapsed(), mimetype="text/plain")
+    elif action != "status":
+        return jsonify({"error": f"Unknown action '{action}'"}), 400
+
+    return jsonify({"running": profiler.running, "interval": profiler.interval, "samples": profiler.samples})
+
 @app.route('/ping', methods=['GET'])
 def ping():
     return jsonify({"message": "Pong!"})
@@ -106,37 +210,49 @@ def get_daily_med():
     if not barcode:
         return jsonify({"status": "error", "message": "barcode required"}), 400
 
+    return jsonify(flight_group("daily_med").do(normalize_key(barcode), lookup_daily_med, barcode))
+
+DAILY_MED_URL = os.getenv("DAILY_MED_URL", "https://dailymed.nlm.nih.gov/dailymed/services/v2/spls.json")
+DAILY_MED_NOT_FOUND = {"status": "not_found", "message": "No drug found for this barcode"}
+
+def ndc_candidates(barcode):
     # Try common NDC segmentations of the barcode
     digits = barcode[-11:] if len(barcode) >= 11 else barcode
-    ndc_formats = [
+    return [
         f"{digits[:5]}-{digits[5:9]}-{digits[9:]}",   # 5-4-2
         f"{digits[:5]}-{digits[5:8]}-{digits[8:]}",   # 5-3-2 (11 digit)
         f"{digits[:4]}-{digits[4:8]}-{digits[8:]}",   # 4-4-2
         digits                                          # raw
     ]
 
-    for ndc in ndc_formats:
+def daily_med_match(data, ndc):
+    spls = data.get("data", [])
+    if not spls:
+        return None
+    spl = spls[0]
+    return {
+        "status": "found",
+        "name": spl.get("title", ""),
+        "set_id": spl.get("setid", ""),
+        "ndc": ndc
+    }
+
+def lookup_daily_med(barcode):
+    for ndc in ndc_candidates(barcode):
         try:
-            r = http.get(
-                "https://dailymed.nlm.nih.gov/dailymed/services/v2/spls.json",
-                params={"ndc": ndc, "pagesize": 1},
-                timeout=5
-            )
-            data = r.json()
-            spls = data.get("data", [])
-            if not spls:
-                continue
-            spl = spls[0]
-            return jsonify({
-                "status": "found",
-                "name": spl.get("title", ""),
-                "set_id": spl.get("setid", ""),
-                "ndc": ndc
-            })
+            with span("upstream", "dailymed"):
+                r = http.get(
+                    DAILY_MED_URL,
+                    params={"ndc": ndc, "pagesize": 1},
+                    timeout=5
+                )
+            found = daily_med_match(r.json(), ndc)
+            if found:
+                return found
         except Exception:
             continue
 
-    return jsonify({"status": "not_found", "message": "No drug found for this barcode"})
+    return DAILY_MED_NOT_FOUND
 
 @app.route("/example/get", methods=['GET'])
 def example_get():
@@ -161,12 +277,13 @@ def spotify_episodes():
         return jsonify({"error": f"Failed to get Spotify access token: {str(e)}"}), 500
 
     episodes = []
-    url = f'https://api.spotify.com/v1/shows/{show_id}/episodes?limit=50'
+    url = SPOTIFY_EPISODES_URL.format(show_id=show_id)
     headers = {'Authorization': f'Bearer {access_token}'}
 
     try:
         while url:
-            res = requests.get(url, headers=headers)
+            with span("upstream", "spotify"):
+                res = requests.get(url, headers=headers)
             res.raise_for_status()
             data = res.json()
             episodes.extend(data['items'])
@@ -182,9 +299,13 @@ def get_response_from_ai():
     prompt = request.args.get("prompt", "")
     return get_response(prompt)
 
-def get_spotify_access_token():
-    client_id = current_app.config.get('SPOTIFY_CLIENT_ID')
-    client_secret = current_app.config.get('SPOTIFY_CLIENT_SECRET')
+SPOTIFY_TOKEN_URL = os.getenv('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+SPOTIFY_EPISODES_URL = SPOTIFY_API_URL + '/shows/{show_id}/episodes?limit=50'
+
+def spotify_token_request(config):
+    client_id = config.get('SPOTIFY_CLIENT_ID')
+    client_secret = config.get('SPOTIFY_CLIENT_SECRET')
     if not client_id or not client_secret:
         raise Exception("Spotify client ID or secret not configured")
 
@@ -196,58 +317,31 @@ def get_spotify_access_token():
         'Content-Type': 'application/x-www-form-urlencoded'
     }
     data = {'grant_type': 'client_credentials'}
-    response = requests.post('https://accounts.spotify.com/api/token', headers=headers, data=data)
+    return headers, data
+
+def get_spotify_access_token():
+    headers, data = spotify_token_request(current_app.config)
+    with span("upstream", "spotify_token"):
+        response = requests.post(SPOTIFY_TOKEN_URL, headers=headers, data=data)
     response.raise_for_status()
     return response.json()['access_token']
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
-    # Create users table only if it doesn't exist
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY
-        )
-    ''')
-
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS recipes (
-            user_id TEXT,
-            title TEXT,
-            description TEXT,
-            ingredients TEXT,
-            procedures TEXT,
-            image_prompt TEXT,
-            image_path TEXT
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-
 init_db()
 
 
-def get_next_user_id():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT MAX(id) FROM users')
-    result = c.fetchone()
-    max_id = result[0] if result[0] is not None else 0
-    next_id = max_id + 1
-    conn.close()
-    return next_id
-
-
 from flask import request, jsonify
 from werkzeug.utils import secure_filename
 import os
 
-WORKER_URL = "https://foodgenimage.kidslearninglab099.workers.dev/"
+WORKER_URL = os.getenv("WORKER_URL", "https://foodgenimage.kidslearninglab099.workers.dev/")
 WORKER_API_KEY = "bob"  # placeholder
 
+def worker_headers():
+    return {
+        "Authorization": f"Bearer {WORKER_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
 @app.route("/generate_image", methods=["POST"])
 def generate_image():
     data = request.get_json(force=True)
@@ -258,15 +352,13 @@ def generate_image():
 
     try:
         # Call your Cloudflare Worker
-        response = requests.post(
-            WORKER_URL,
-            headers={
-                "Authorization": f"Bearer {WORKER_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={"prompt": prompt},
-            timeout=30
-        )
+        with LIMITERS["image"].slot(BULK), span("upstream", "image"):
+            response = requests.post(
+                WORKER_URL,
+                headers=worker_headers(),
+                json={"prompt": prompt},
+                timeout=30
+            )
 
         if response.status_code != 200:
             return {"error": f"Worker failed: {response.text}"}, response.status_code
@@ -279,6 +371,8 @@ def generate_image():
             download_name="generated.jpg"
         )
 
+    except AdmissionRefused:
+        raise
     except Exception as e:
         return {"error": str(e)}, 500
 
@@ -295,98 +389,111 @@ def get_facts():
         return jsonify({"error": "Invalid input"}), 400
 
     recipe = data['recipe_text']
-    facts_string = get_nutrition_facts(recipe)
+    facts_string = flight_group("get_facts").do(normalize_key(recipe), get_nutrition_facts, recipe)
+
+    body, status = facts_payload(facts_string)
+    return jsonify(body), status
 
+def facts_payload(facts_string):
     keys = [
         "totalfat", "saturatedfat", "transfat", "cholesterol", "sodium",
         "totalcarbs", "dietaryfiber", "totalsugar", "addedsugar", "protein", "calories"
     ]
 
     if not facts_string:
-        return jsonify({"error": "No facts returned"}), 500
+        return {"error": "No facts returned"}, 500
 
     values = facts_string.split(";")
     if len(values) != len(keys):
-        return jsonify({"error": "Unexpected facts format"}), 500
+        return {"error": "Unexpected facts format"}, 500
 
     facts_dict = dict(zip(keys, values))
     facts_dict["calories"] = facts_dict["calories"].strip()
     facts_dict["totalfat"] = facts_dict["totalfat"].strip()
 
-    return jsonify({"facts": facts_dict})
+    return {"facts": facts_dict}, 200
 
-VISION_WORKER_URL = "https://kidslearninglab.nameless-cherry-998c.workers.dev/"
+VISION_WORKER_URL = os.getenv("VISION_WORKER_URL", "https://kidslearninglab.nameless-cherry-998c.workers.dev/")
+SCAN_PROMPT = "This is a food image. Respond ONLY in this exact format with no extra text: title;description;ingredient1,ingredient2,ingredient3;step1,step2,step3. If you cannot identify a recipe, respond with: 0;0;0;0"
+SCAN_QUOTA_ERROR = "Maximum image scanning quota reached daily! You can create free ingredient-based recipes."
 
-@app.route('/scan_recipe', methods=['POST'])
-def scan_recipe():
-    user_id = request.form.get('user_id')
+def parse_scan_response(gemini_response):
+    parts = gemini_response.strip().split(";")
+    if len(parts) < 4 or parts[0] == "0":
+        return None
 
-    if 'image' not in request.files:
-        return jsonify({"error": "No image file provided"}), 400
+    title = parts[0].strip()
+    description = parts[1].strip()
+    ingredients = [i.strip() for i in parts[2].split(",")]
+    procedures = [p.strip() for p in parts[3].split("|")]
+    return title, description, ingredients, procedures
 
-    image_file = request.files['image']
+def scan_upload(files):
+    # Returns (filename, image_path), or an error payload for a missing upload
+    if 'image' not in files:
+        return None, ({"error": "No image file provided"}, 400)
+
+    image_file = files['image']
     if image_file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        return None, ({"error": "No selected file"}, 400)
 
     filename = secure_filename(image_file.filename)
-    unique_filename = f"{uuid.uuid4()}_{filename}"
-    save_folder = 'images'
-    os.makedirs(save_folder, exist_ok=True)
-    image_path = os.path.join(save_folder, unique_filename)
-    image_file.save(image_path)
+    return (filename, os.path.join('images', f"{uuid.uuid4()}_{filename}")), None
+
+def scan_result(user_id, worker_response, image_path):
+    # Shared by the Flask and ASGI /scan_recipe; returns (body, status)
+    if worker_response.status_code != 200:
+        return {"error": "Image scanning worker failed"}, 500
+
+    gemini_response = worker_response.json().get("text", "").strip()
+
+    if not gemini_response:
+        LIMITERS["vision"].exhaust()
+        return {"error": SCAN_QUOTA_ERROR}, 500
+
+    parsed = parse_scan_response(gemini_response)
+    if parsed is None:
+        return {"error": "Could not create a recipe from this image"}, 400
+
+    title, description, ingredients, procedures = parsed
+
+    if user_id:
+        title = save_recipe(user_id, title, description, ",".join(ingredients), ",".join(procedures), "", image_path)
+
+    return {
+        "title": title,
+        "description": description,
+        "ingredients": ingredients,
+        "procedures": procedures
+    }, 200
+
+@app.route('/scan_recipe', methods=['POST'])
+def scan_recipe():
+    user_id = request.form.get('user_id')
+
+    upload, error = scan_upload(request.files)
+    if error:
+        return jsonify(error[0]), error[1]
+
+    _, image_path = upload
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    with span("stage", "save_upload"):
+        request.files['image'].save(image_path)
 
     try:
-        with open(image_path, "rb") as f:
+        with open(image_path, "rb") as f, LIMITERS["vision"].slot(INTERACTIVE), span("upstream", "vision"):
             worker_response = requests.post(
                 VISION_WORKER_URL,
-                data={"prompt": "This is a food image. Respond ONLY in this exact format with no extra text: title;description;ingredient1,ingredient2,ingredient3;step1,step2,step3. If you cannot identify a recipe, respond with: 0;0;0;0"},
+                data={"prompt": SCAN_PROMPT},
                 files={"image": f},
                 timeout=30
             )
 
-        if worker_response.status_code != 200:
-            return jsonify({"error": "Image scanning worker failed"}), 500
-
-        gemini_response = worker_response.json().get("text", "").strip()
-
-        if not gemini_response:
-            return jsonify({"error": "Maximum image scanning quota reached daily! You can create free ingredient-based recipes."}), 500
-
-        parts = gemini_response.strip().split(";")
-        if len(parts) < 4 or parts[0] == "0":
-            return jsonify({"error": "Could not create a recipe from this image"}), 400
-
-        title = parts[0].strip()
-        description = parts[1].strip()
-        ingredients = [i.strip() for i in parts[2].split(",")]
-        procedures = [p.strip() for p in parts[3].split("|")]
-
-        if user_id:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            original_title = title
-            suffix = 1
-            while True:
-                c.execute('SELECT COUNT(*) FROM recipes WHERE user_id = ? AND title = ?', (user_id, title))
-                if c.fetchone()[0] == 0:
-                    break
-                title = f"{original_title} ({suffix})"
-                suffix += 1
-
-            c.execute('''
-                INSERT INTO recipes (user_id, title, description, ingredients, procedures, image_prompt, image_path)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, title, description, ",".join(ingredients), ",".join(procedures), "", image_path))
-            conn.commit()
-            conn.close()
-
-        return jsonify({
-            "title": title,
-            "description": description,
-            "ingredients": ingredients,
-            "procedures": procedures
-        })
+        body, status = scan_result(user_id, worker_response, image_path)
+        return jsonify(body), status
 
+    except AdmissionRefused:
+        raise
     except Exception as e:
         return jsonify({"error": f"Internal error: {str(e)}"}), 500
 
@@ -402,19 +509,27 @@ def pollinate():
         return jsonify({"error": "Missing prompt"}), 400
 
     prompt = data['prompt']
+    # Identical prompts in flight at the same time share one generated image
+    image_path, error = flight_group("pollinate").do(normalize_key(prompt), pollinate_image, prompt)
+    if error:
+        return jsonify({"error": error}), 500
+
+# Instead of returning the image directly, return the filename
+    return jsonify({"filename": os.path.basename(image_path)})
+
+def pollinate_image(prompt):
     image_filename = f"images/{uuid.uuid4()}.png"
     os.makedirs(os.path.dirname(image_filename), exist_ok=True)
 
     image_path = get_image_pollinations(prompt, image_filename)
     if not image_path:
-        return jsonify({"error": "Image generation failed"}), 500
+        return None, "Image generation failed"
 
     crop_result = crop_bottom(image_path, 60)
     if crop_result is None:
-        return jsonify({"error": "Image cropping failed"}), 500
+        return None, "Image cropping failed"
 
-# Instead of returning the image directly, return the filename
-    return jsonify({"filename": os.path.basename(image_path)})
+    return image_path, None
 
 from flask import send_from_directory
 
@@ -441,92 +556,85 @@ def get_id():
 @app.route('/reset_db')
 def reset_db():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('DROP TABLE IF EXISTS users')
-        c.execute('DROP TABLE IF EXISTS recipes')
-        conn.commit()
-        conn.close()
-        init_db()
+        storage.reset_db()
         return "Tables dropped, DB reset"
     except Exception as e:
         return f"Error: {str(e)}"
 
+def recipe_args(data):
+    return (
+        data.get('ingredients', []), data.get('budget', 0), data.get('serves', 0),
+        data.get('time', 0), data.get('meal_type', 'dinner'),
+    )
+
+def recipe_text_error(parsed):
+    # Shared by the Flask and ASGI /create_recipe; None when the text is usable
+    if parsed is None:
+        return {"error": "Could not generate recipe"}, 400
+    if not parsed[4]:
+        return {"error": "Recipe returned no prompt for image"}, 500
+    return None
+
+def store_recipe(user_id, parsed, worker_response):
+    # Save the worker's image and the recipe; returns (body, status)
+    if worker_response.status_code != 200:
+        return {"error": f"Worker failed: {worker_response.text}"}, worker_response.status_code
+
+    title, desc, ing, procedures, prompt = parsed
+
+    # Generate unique filename for AI image
+    image_filename = f"images/{uuid.uuid4()}.jpg"
+    with span("stage", "save_image"):
+        write_file(image_filename, worker_response.content)
+
+    # Insert recipe with image into DB under a per-user unique title
+    title = save_recipe(user_id, title, desc, ing, procedures, prompt, image_filename)
+
+    return {
+        "title": title,
+        "description": desc,
+        "ingredients": ing,
+        "procedures": procedures,
+        "image_prompt": prompt,
+        "image_path": image_filename
+    }, 200
+
 @app.route('/create_recipe', methods=['POST'])
 def create_recipe():
     data = request.json
     user_id = data.get('user_id')
-    ingredients = data.get('ingredients', [])
-    budget = data.get('budget', 0)
-    time_val = data.get('time', 0)
-    serves = data.get('serves', 0)
-    meal_type = data.get('meal_type', 'dinner')
 
     if not user_id:
         return jsonify({"error": "Missing user_id"}), 400
 
     try:
         # Generate the recipe using your Gemini logic
-        title, desc, ing, procedures, prompt, _ = get_recipe(ingredients, budget, serves, time_val, meal_type)
-
-        if result := [title, desc, ing, procedures, prompt]:
-            if all(x == "0" for x in result):
-                return jsonify({"error": "Could not generate recipe"}), 400
-
-        if not prompt:
-            return jsonify({"error": "Recipe returned no prompt for image"}), 500
-
-        # Generate unique filename for AI image
-        image_filename = f"images/{uuid.uuid4()}.jpg"
-        os.makedirs(os.path.dirname(image_filename), exist_ok=True)
-
-        # Call Cloudflare Worker to generate image
-        response = requests.post(
-            WORKER_URL,
-            headers={
-                "Authorization": f"Bearer {WORKER_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={"prompt": prompt},
-            timeout=30
-        )
+        with span("stage", "recipe_text"):
+            parsed = get_recipe_text(*recipe_args(data), INTERACTIVE)
 
-        if response.status_code != 200:
-            return jsonify({"error": f"Worker failed: {response.text}"}), response.status_code
-
-        with open(image_filename, "wb") as f:
-            f.write(response.content)
-
-        # Make title unique per user
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        original_title = title
-        suffix = 1
-        while True:
-            c.execute('SELECT COUNT(*) FROM recipes WHERE user_id = ? AND title = ?', (user_id, title))
-            count = c.fetchone()[0]
-            if count == 0:
-                break
-            title = f"{original_title} ({suffix})"
-            suffix += 1
-
-        # Insert recipe with image into DB
-        c.execute('''
-            INSERT INTO recipes (user_id, title, description, ingredients, procedures, image_prompt, image_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, title, desc, ing, procedures, prompt, image_filename))
-        conn.commit()
-        conn.close()
+        error = recipe_text_error(parsed)
+        if error:
+            return jsonify(error[0]), error[1]
 
-        return jsonify({
-            "title": title,
-            "description": desc,
-            "ingredients": ing,
-            "procedures": procedures,
-            "image_prompt": prompt,
-            "image_path": image_filename
-        })
+        title, prompt = parsed[0], parsed[4]
 
+        with span("stage", "recipe_images"):
+            render_recipe_image(title, prompt)
+
+            # Call Cloudflare Worker to generate image
+            with LIMITERS["image"].slot(INTERACTIVE), span("upstream", "image"):
+                response = requests.post(
+                    WORKER_URL,
+                    headers=worker_headers(),
+                    json={"prompt": prompt},
+                    timeout=30
+                )
+
+        body, status = store_recipe(user_id, parsed, response)
+        return jsonify(body), status
+
+    except AdmissionRefused:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -540,15 +648,7 @@ def get_recipes():
         return jsonify({"error": "Missing user_id"}), 400
 
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''
-            SELECT title, description, ingredients, procedures, image_prompt, image_path
-            FROM recipes
-            WHERE user_id = ?
-        ''', (user_id,))
-        recipes = c.fetchall()
-        conn.close()
+        recipes = storage.get_recipes(user_id)
 
         recipe_list = [
             {
@@ -568,6 +668,53 @@ def get_recipes():
         return jsonify({"error": str(e)}), 500
 
 
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+
+def search_terms(raw_query):
+    # Only plain words reach the full-text engine, never its query syntax
+    return re.findall(r"\w+", raw_query, re.UNICODE)
+
+
+@app.route('/search_recipes', methods=['GET'])
+def search_recipes():
+    query = request.args.get('q', '').strip()
+    user_id = request.args.get('user_id')
+
+    if not query:
+        return jsonify({"error": "Missing q"}), 400
+
+    try:
+        limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    offset = max(0, offset)
+
+    try:
+        total, rows = storage.search_recipes(search_terms(query), user_id, limit, offset)
+
+        recipe_list = [
+            {
+                "title": r[0],
+                "description": r[1],
+                "ingredients": r[2] if isinstance(r[2], str) else "",
+                "procedures": r[3] if isinstance(r[3], str) else "",
+                "image_prompt": r[4],
+                "image_path": r[5],
+                "score": r[6]
+            } for r in rows
+        ]
+
+        return jsonify({"recipes": recipe_list, "total": total, "limit": limit, "offset": offset})
+
+    except Exception as e:
+        print(f"Error in search_recipes: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/get_image', methods=['GET'])
 def get_image():
     user_id = request.args.get('user_id')
@@ -581,11 +728,7 @@ def get_image():
 
     try:
         # Main lookup: by user_id and title
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT image_path FROM recipes WHERE user_id = ? AND title = ?', (user_id, title))
-        result = c.fetchone()
-        conn.close()
+        result = storage.get_image_path(user_id, title)
 
         if result:
             image_path = result[0]
@@ -603,36 +746,28 @@ def get_image():
                 return jsonify({"error": "File missing on disk"}), 404
 
         # Fallback: check by title only (ignore user_id)
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT title FROM recipes')
-        available_titles = [row[0].strip() for row in c.fetchall()]
-        conn.close()
+        try:
+            sql_return = storage.get_image_path_by_title(title)
+
+            if sql_return:
+                fallback_path = sql_return[0]
+                if os.path.exists(fallback_path):
+                    print(f"Fallback image found: {fallback_path}")
+                    response = make_response(send_file(fallback_path, mimetype='image/png'))
+                    response.headers['Access-Control-Allow-Origin'] = "*"
+                    return response
+                else:
+                    print(f"Fallback file does not exist: {fallback_path}")
+                    return jsonify({"error": "Fallback image missing"}), 404
+
+        except Exception as e:
+            print(f"Error in fallback block: {str(e)}")
+            return jsonify({"error": str(e)}), 500
 
+        # Only list every title when nothing matched
+        available_titles = storage.get_all_titles()
         if title in available_titles:
-            try:
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute('SELECT image_path FROM recipes WHERE title = ?', (title,))
-                sql_return = c.fetchone()
-                conn.close()
-
-                if sql_return:
-                    fallback_path = sql_return[0]
-                    if os.path.exists(fallback_path):
-                        print(f"Fallback image found: {fallback_path}")
-                        response = make_response(send_file(fallback_path, mimetype='image/png'))
-                        response.headers['Access-Control-Allow-Origin'] = "*"
-                        return response
-                    else:
-                        print(f"Fallback file does not exist: {fallback_path}")
-                        return jsonify({"error": "Fallback image missing"}), 404
-
-                return jsonify({"error": "Title matched, but no image_path"}), 404
-
-            except Exception as e:
-                print(f"Error in fallback block: {str(e)}")
-                return jsonify({"error": str(e)}), 500
+            return jsonify({"error": "Title matched, but no image_path"}), 404
 
         # No match at all
         return jsonify({
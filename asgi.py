@@ -0,0 +1,328 @@
+"""Async serving mode.
+
+Run with an ASGI server, e.g.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+The routes that mostly wait on upstream HTTP are served natively on the
+event loop, so one process can keep hundreds of upstream calls in flight.
+Only the upstream I/O differs between the two modes; validation, parsing
+and persistence are the same helpers the Flask routes call. Every other
+route (and CORS preflight) falls through to the Flask app.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from io import BytesIO
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.formparser import parse_form_data
+
+from app import (
+    app, WORKER_URL, VISION_WORKER_URL, SCAN_PROMPT,
+    DAILY_MED_URL, DAILY_MED_NOT_FOUND, SPOTIFY_TOKEN_URL, SPOTIFY_EPISODES_URL,
+    ndc_candidates, daily_med_match, facts_payload, spotify_token_request, worker_headers,
+    scan_upload, scan_result, recipe_args, recipe_text_error, store_recipe,
+)
+from recipe_generator import (
+    async_client, close_async_client, get_response_async, get_image_pollinations_async,
+    crop_bottom_async, post_worker_async, get_recipe_text_async, render_recipe_image_async,
+    get_nutrition_facts_async, write_file,
+)
+from admission import AdmissionRefused, INTERACTIVE, BULK
+from metrics import span, observe_request
+from singleflight import async_group, normalize_key
+
+# Runs the Flask routes on a thread pool; asgiref's WsgiToAsgi pins every
+# request to one thread, which serialized the whole fallback
+wsgi_fallback = WSGIMiddleware(app, workers=int(os.getenv("ASGI_WSGI_THREADS", 32)))
+
+
+# -----------------------------
+# MINIMAL REQUEST / RESPONSE
+# -----------------------------
+class AsyncRequest:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        self.args = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+        self.body = body
+
+    def get_json(self):
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            return None
+
+    def form_data(self):
+        environ = {
+            "REQUEST_METHOD": self.method,
+            "CONTENT_TYPE": self.headers.get("content-type", ""),
+            "CONTENT_LENGTH": str(len(self.body)),
+            "wsgi.input": BytesIO(self.body),
+        }
+        _, form, files = parse_form_data(environ)
+        return form, files
+
+
+def json_response(payload, status=200, headers=None):
+    return status, "application/json", json.dumps(payload).encode(), headers or {}
+
+
+def raw_response(content, content_type, status=200):
+    return status, content_type, content, {}
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_response(send, status, content_type, content, headers):
+    header_list = [
+        (b"content-type", content_type.encode()),
+        (b"content-length", str(len(content)).encode()),
+        (b"access-control-allow-origin", b"*"),
+    ]
+    header_list += [(k.lower().encode(), str(v).encode()) for k, v in headers.items()]
+    await send({"type": "http.response.start", "status": status, "headers": header_list})
+    await send({"type": "http.response.body", "body": content})
+
+
+ROUTES = {}
+
+
+def route(path, method):
+    def decorator(fn):
+        ROUTES[(method, path)] = fn
+        return fn
+    return decorator
+
+
+# -----------------------------
+# ASYNC ROUTES
+# -----------------------------
+@route("/get_response", "GET")
+async def get_response_from_ai(req):
+    answer = await get_response_async(req.args.get("prompt", ""))
+    return raw_response(answer.encode(), "text/html; charset=utf-8")
+
+
+@route("/generate_image", "POST")
+async def generate_image(req):
+    data = req.get_json()
+    if not data or "prompt" not in data:
+        return json_response({"error": "Missing 'prompt' in JSON"}, 400)
+
+    response = await post_worker_async(
+        WORKER_URL, "image", BULK, headers=worker_headers(), json={"prompt": data["prompt"]}
+    )
+    if response.status_code != 200:
+        return json_response({"error": f"Worker failed: {response.text}"}, response.status_code)
+
+    return raw_response(response.content, "image/jpeg")
+
+
+@route("/get_facts", "POST")
+async def get_facts(req):
+    data = req.get_json()
+    if not data or 'recipe_text' not in data:
+        return json_response({"error": "Invalid input"}, 400)
+
+    recipe = data['recipe_text']
+    facts_string = await async_group("get_facts").do(normalize_key(recipe), get_nutrition_facts_async, recipe)
+
+    body, status = facts_payload(facts_string)
+    return json_response(body, status)
+
+
+async def lookup_daily_med_async(barcode):
+    for ndc in ndc_candidates(barcode):
+        try:
+            with span("upstream", "dailymed"):
+                r = await async_client().get(DAILY_MED_URL, params={"ndc": ndc, "pagesize": 1}, timeout=5)
+            found = daily_med_match(r.json(), ndc)
+            if found:
+                return found
+        except Exception:
+            continue
+
+    return DAILY_MED_NOT_FOUND
+
+
+@route("/get_daily_med", "GET")
+async def get_daily_med(req):
+    barcode = req.args.get("barcode", "").strip()
+    if not barcode:
+        return json_response({"status": "error", "message": "barcode required"}, 400)
+
+    result = await async_group("daily_med").do(normalize_key(barcode), lookup_daily_med_async, barcode)
+    return json_response(result)
+
+
+@route("/api/spotify-episodes", "GET")
+async def spotify_episodes(req):
+    client = async_client()
+    show_id = app.config.get('SPOTIFY_SHOW_ID', '7C7zL1MoVdOjUgxQyhO6rQ')
+    try:
+        headers, data = spotify_token_request(app.config)
+        with span("upstream", "spotify_token"):
+            token_response = await client.post(SPOTIFY_TOKEN_URL, headers=headers, data=data)
+        token_response.raise_for_status()
+        access_token = token_response.json()['access_token']
+    except Exception as e:
+        return json_response({"error": f"Failed to get Spotify access token: {str(e)}"}, 500)
+
+    episodes = []
+    url = SPOTIFY_EPISODES_URL.format(show_id=show_id)
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    try:
+        while url:
+            with span("upstream", "spotify"):
+                res = await client.get(url, headers=headers)
+            res.raise_for_status()
+            data = res.json()
+            episodes.extend(data['items'])
+            url = data.get('next')
+
+        return json_response([{'title': ep['name'], 'spotifyId': ep['id']} for ep in episodes])
+    except Exception as e:
+        return json_response({"error": f"Failed to fetch episodes from Spotify API: {str(e)}"}, 500)
+
+
+async def pollinate_image_async(prompt):
+    image_filename = f"images/{uuid.uuid4()}.png"
+
+    image_path = await get_image_pollinations_async(prompt, image_filename)
+    if not image_path:
+        return None, "Image generation failed"
+
+    if await crop_bottom_async(image_path, 60) is None:
+        return None, "Image cropping failed"
+
+    return image_path, None
+
+
+@route("/pollinate", "POST")
+async def pollinate(req):
+    data = req.get_json()
+    if not data or 'prompt' not in data:
+        return json_response({"error": "Missing prompt"}, 400)
+
+    prompt = data['prompt']
+    image_path, error = await async_group("pollinate").do(normalize_key(prompt), pollinate_image_async, prompt)
+    if error:
+        return json_response({"error": error}, 500)
+
+    return json_response({"filename": os.path.basename(image_path)})
+
+
+@route("/scan_recipe", "POST")
+async def scan_recipe(req):
+    form, files = req.form_data()
+    user_id = form.get('user_id')
+
+    upload, error = scan_upload(files)
+    if error:
+        return json_response(*error)
+
+    filename, image_path = upload
+    image_bytes = files['image'].read()
+
+    try:
+        with span("stage", "save_upload"):
+            await asyncio.to_thread(write_file, image_path, image_bytes)
+
+        worker_response = await post_worker_async(
+            VISION_WORKER_URL, "vision", INTERACTIVE,
+            data={"prompt": SCAN_PROMPT},
+            files={"image": (filename, image_bytes)},
+        )
+
+        return json_response(*await asyncio.to_thread(scan_result, user_id, worker_response, image_path))
+
+    except AdmissionRefused:
+        raise
+    except Exception as e:
+        return json_response({"error": f"Internal error: {str(e)}"}, 500)
+
+
+@route("/create_recipe", "POST")
+async def create_recipe(req):
+    data = req.get_json() or {}
+    user_id = data.get('user_id')
+
+    if not user_id:
+        return json_response({"error": "Missing user_id"}, 400)
+
+    try:
+        with span("stage", "recipe_text"):
+            parsed = await get_recipe_text_async(*recipe_args(data), INTERACTIVE)
+
+        error = recipe_text_error(parsed)
+        if error:
+            return json_response(*error)
+
+        title, prompt = parsed[0], parsed[4]
+
+        # Both images only depend on the generated text, so render them side by side
+        with span("stage", "recipe_images"):
+            _, response = await asyncio.gather(
+                render_recipe_image_async(title, prompt),
+                post_worker_async(WORKER_URL, "image", INTERACTIVE, headers=worker_headers(), json={"prompt": prompt}),
+            )
+
+        return json_response(*await asyncio.to_thread(store_recipe, user_id, parsed, response))
+
+    except AdmissionRefused:
+        raise
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+# -----------------------------
+# ASGI ENTRY POINT
+# -----------------------------
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    handler = ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler is None:
+        return await wsgi_fallback(scope, receive, send)
+
+    started = time.perf_counter()
+    req = AsyncRequest(scope, await read_body(receive))
+    try:
+        status, content_type, content, headers = await handler(req)
+    except AdmissionRefused as e:
+        status, content_type, content, headers = json_response(
+            {"error": e.message, "worker": e.worker, "retry_after": e.retry_after},
+            e.status_code, {"Retry-After": e.retry_after}
+        )
+    except Exception as e:
+        status, content_type, content, headers = json_response({"error": str(e)}, 500)
+
+    await send_response(send, status, content_type, content, headers)
+    observe_request(req.method, req.path, status, time.perf_counter() - started)
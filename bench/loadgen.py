@@ -0,0 +1,387 @@
+"""Load driver for the recipe API.
+
+Starts the upstream stubs, seeds a database at each requested size, boots
+the app (gunicorn or uvicorn) against them and drives a closed-loop load at
+every endpoint, reporting throughput and p50/p95/p99 latency as JSON:
+
+    python -m bench.loadgen --db-sizes 0,10000,100000 --concurrency 32 --duration 20 \\
+        --output bench_results.json
+
+Every endpoint runs against a fresh copy of the seeded database, so rows
+written by /create_recipe or /scan_recipe never leak into the numbers of
+the endpoints measured after them.
+
+Pass --baseline with an earlier results file to fail (exit 1) when any
+endpoint's p95 regresses by more than --max-regression, or its error rate
+rises by more than --max-error-increase.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from bench import stubs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_ENDPOINTS = ("create_recipe", "scan_recipe", "get_recipes", "get_image", "conjugate")
+# Endpoints that only make sense when there are seeded rows to look up
+NEEDS_SEED = ("get_image",)
+VERBS = ("hablar", "comer", "vivir", "tener", "ser", "estar", "ir", "hacer", "poder", "decir")
+TENSES = ("present", "preterite", "imperfect", "future", "conditional", "subjunctive")
+RECIPES_PER_USER = 50
+
+
+# -----------------------------
+# DATABASE SEEDING
+# -----------------------------
+def seed_database(db_url, size, image_path):
+    """Create a database with `size` recipes; returns the seeded (user_id, title) pairs."""
+    import storage
+
+    storage.engine = storage.make_engine(db_url)
+    storage.init_db()
+
+    seeded = []
+    batch = []
+    for i in range(size):
+        user_id = f"bench-user-{i // RECIPES_PER_USER}"
+        title = f"Seeded Recipe {i}"
+        seeded.append((user_id, title))
+        batch.append({
+            "user_id": user_id,
+            "title": title,
+            "description": "A seeded recipe for load testing",
+            "ingredients": "rice,beans,salt,pepper",
+            "procedures": "Cook the rice,Add the beans,Season to taste",
+            "image_prompt": "a bowl of rice and beans",
+            "image_path": image_path,
+        })
+        if len(batch) >= 5000:
+            storage.save_recipes(batch)
+            batch = []
+    storage.save_recipes(batch)
+    storage.engine.dispose()
+    return seeded
+
+
+# -----------------------------
+# APP PROCESS
+# -----------------------------
+def start_app(mode, port, workers, threads, env, cwd):
+    if mode == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:application", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(workers),
+               "-k", "gthread", "--threads", str(threads), "--log-level", "warning", "app:app"]
+    # The app prints per-request diagnostics; keep them out of the report
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"App exited with code {proc.returncode}")
+        try:
+            if requests.get(base_url + "/ping", timeout=1).status_code == 200:
+                return proc, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("App did not come up within 60s")
+
+
+def stop_app(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# -----------------------------
+# SCENARIOS
+# -----------------------------
+class Scenarios:
+    def __init__(self, base_url, seeded, scan_image):
+        self.base_url = base_url
+        self.seeded = seeded
+        self.scan_image = scan_image
+
+    def _user(self):
+        if self.seeded:
+            return random.choice(self.seeded)[0]
+        return f"bench-user-{random.randint(0, 99)}"
+
+    def create_recipe(self, session):
+        return session.post(self.base_url + "/create_recipe", json={
+            "user_id": self._user(),
+            "ingredients": ["rice", "beans"],
+            "budget": 20, "time": 30, "serves": 2, "meal_type": "dinner",
+        }, timeout=120)
+
+    def scan_recipe(self, session):
+        return session.post(self.base_url + "/scan_recipe", data={"user_id": self._user()},
+                            files={"image": ("scan.jpg", self.scan_image, "image/jpeg")}, timeout=120)
+
+    def get_recipes(self, session):
+        return session.get(self.base_url + "/get_recipes", params={"user_id": self._user()}, timeout=60)
+
+    def get_image(self, session):
+        user_id, title = random.choice(self.seeded)
+        return session.get(self.base_url + "/get_image", params={"user_id": user_id, "title": title}, timeout=60)
+
+    def conjugate(self, session):
+        return session.get(self.base_url + "/conjugate",
+                           params={"verb": random.choice(VERBS), "tense": random.choice(TENSES)}, timeout=60)
+
+    def search_recipes(self, session):
+        return session.get(self.base_url + "/search_recipes", params={"q": "rice bea"}, timeout=60)
+
+    def get_daily_med(self, session):
+        return session.get(self.base_url + "/get_daily_med",
+                           params={"barcode": str(random.randint(10 ** 10, 10 ** 11 - 1))}, timeout=60)
+
+    def spotify_episodes(self, session):
+        return session.get(self.base_url + "/api/spotify-episodes", timeout=60)
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def run_load(call, concurrency, duration, warmup):
+    latencies = []
+    statuses = {}
+    errors = 0
+    lock = threading.Lock()
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+
+    def worker():
+        nonlocal errors
+        session = requests.Session()
+        while True:
+            began = time.monotonic()
+            if began >= stop_at:
+                return
+            try:
+                response = call(session)
+                status = response.status_code
+            except requests.RequestException:
+                status = "exception"
+            elapsed = time.monotonic() - began
+            if began < start_at:
+                continue
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == "exception" or status >= 400:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": round(errors / len(latencies), 4) if latencies else None,
+        "statuses": statuses,
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p95_ms": _ms(percentile(latencies, 95)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(latencies[-1]) if latencies else None,
+    }
+
+
+# -----------------------------
+# REPORTING
+# -----------------------------
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, max_regression, max_error_increase):
+    with open(baseline_path) as f:
+        baseline = {(r["endpoint"], r["db_size"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for r in results:
+        before = baseline.get((r["endpoint"], r["db_size"]))
+        if not before:
+            continue
+        where = f"{r['endpoint']} @ {r['db_size']} rows"
+
+        # Checked first: an endpoint that starts failing fast would otherwise
+        # pass as a latency improvement
+        error_change = (r.get("error_rate") or 0) - (before.get("error_rate") or 0)
+        r["error_rate_change_vs_baseline"] = round(error_change, 4)
+        if error_change > max_error_increase:
+            regressions.append(f"{where}: error rate {before.get('error_rate')} -> {r.get('error_rate')}")
+
+        if not before.get("p95_ms") or r.get("p95_ms") is None:
+            continue
+        change = (r["p95_ms"] - before["p95_ms"]) / before["p95_ms"]
+        r["p95_change_vs_baseline"] = round(change, 4)
+        if change > max_regression:
+            regressions.append(f"{where}: p95 {before['p95_ms']}ms -> {r['p95_ms']}ms")
+    return regressions
+
+
+def restore_database(seed_path, db_path):
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    shutil.copyfile(seed_path, db_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="threads per gunicorn worker")
+    parser.add_argument("--endpoints", default=",".join(DEFAULT_ENDPOINTS))
+    parser.add_argument("--db-sizes", default="0,1000,10000", help="comma separated recipe counts")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per endpoint")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds per endpoint")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier results file to compare p95 against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p95 increase, 0.2 = 20%%")
+    parser.add_argument("--max-error-increase", type=float, default=0.01,
+                        help="allowed absolute error rate increase, 0.01 = one point")
+    stubs.add_stub_args(parser)
+    args = parser.parse_args(argv)
+
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = [e for e in endpoints if not hasattr(Scenarios, e)]
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(unknown)}")
+    db_sizes = [int(s) for s in args.db_sizes.split(",") if s]
+
+    stub_servers, urls = stubs.start_all(stubs.configs_from_args(args))
+    scan_image = stubs.make_image(args.payload_kb, "JPEG")
+
+    results = []
+    try:
+        for size in db_sizes:
+            workdir = tempfile.mkdtemp(prefix="foodgen-bench-")
+            try:
+                image_path = os.path.join(workdir, "images", "seed.jpg")
+                os.makedirs(os.path.dirname(image_path))
+                with open(image_path, "wb") as f:
+                    f.write(scan_image)
+
+                seed_path = os.path.join(workdir, "seed.db")
+                db_path = os.path.join(workdir, "bench.db")
+                seeded = seed_database(f"sqlite:///{seed_path}", size, image_path)
+
+                env = dict(os.environ)
+                env.update(stubs.app_env(urls))
+                env["DATABASE_URL"] = f"sqlite:///{db_path}"
+                env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+                # Lets admission control split its limits across the workers
+                env["WEB_CONCURRENCY"] = str(args.workers)
+                # Measure the app, not the daily quotas; concurrency caps still apply
+                for worker in ("TEXT", "IMAGE", "VISION"):
+                    env.setdefault(f"{worker}_WORKER_DAILY_QUOTA", str(10 ** 9))
+
+                for endpoint in endpoints:
+                    if endpoint in NEEDS_SEED and not seeded:
+                        print(f"{endpoint:>18} @ {size:>7} rows: skipped, nothing seeded to look up", file=sys.stderr)
+                        continue
+
+                    restore_database(seed_path, db_path)
+                    proc, base_url = start_app(args.mode, free_port(), args.workers, args.threads, env, workdir)
+                    try:
+                        scenarios = Scenarios(base_url, seeded, scan_image)
+                        stats = run_load(getattr(scenarios, endpoint), args.concurrency, args.duration, args.warmup)
+                    finally:
+                        stop_app(proc)
+
+                    stats.update(endpoint=endpoint, db_size=size)
+                    results.append(stats)
+                    print(f"{endpoint:>18} @ {size:>7} rows: {stats['throughput_rps']:>8} rps  "
+                          f"p50 {stats['p50_ms']}ms  p95 {stats['p95_ms']}ms  p99 {stats['p99_ms']}ms  "
+                          f"errors {stats['errors']}", file=sys.stderr)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        for server in stub_servers.values():
+            server.shutdown()
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.max_regression, args.max_error_increase)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "mode": args.mode,
+            "workers": args.workers,
+            "threads": args.threads,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "stubs": {
+                "latency_ms": args.latency_ms,
+                "jitter": args.jitter,
+                "failure_rate": args.failure_rate,
+                "payload_kb": args.payload_kb,
+                "overrides": args.set,
+            },
+        },
+        "results": results,
+        "regressions": regressions,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for line in regressions:
+        print(f"REGRESSION: {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""Local stand-ins for every upstream the app talks to.
+
+Each upstream gets its own HTTP server with configurable latency, failure
+rate and image payload size, so benchmarks never touch the real workers:
+
+    python -m bench.stubs --latency-ms 200 --set text.latency_ms=1500 --set vision.failure_rate=0.05
+
+The first line printed is a JSON object mapping upstream name to base URL.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+UPSTREAMS = ("text", "pollinations", "image", "vision", "dailymed", "spotify")
+
+NUTRITION_FACTS = "12g;4g;0g;30mg;400mg;45g;6g;8g;2g;25g;450"
+
+
+class StubConfig:
+    def __init__(self, latency_ms=50.0, jitter=0.2, failure_rate=0.0, payload_kb=64):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.payload_kb = payload_kb
+
+    def delay(self):
+        spread = self.latency_ms * self.jitter
+        return max(0.0, random.uniform(self.latency_ms - spread, self.latency_ms + spread)) / 1000
+
+    def fails(self):
+        return random.random() < self.failure_rate
+
+
+def make_image(payload_kb, fmt):
+    # Random noise barely compresses, so the encoded size tracks payload_kb
+    side = max(80, int((payload_kb * 1024 / 3) ** 0.5))
+    img = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buf = io.BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
+
+
+# -----------------------------
+# HANDLERS
+# -----------------------------
+class StubHandler(BaseHTTPRequestHandler):
+    kind = None
+    config = None
+    image_bytes = b""
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, a keep-alive
+    # client waits out the delayed ACK (~40ms) on every call
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, payload, status=200):
+        self._send(status, "application/json", json.dumps(payload).encode())
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _handle(self):
+        body = self._read_body()
+        time.sleep(self.config.delay())
+        if self.config.fails():
+            return self._json({"error": "stub failure"}, 500)
+        return getattr(self, f"_{self.kind}")(body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def _text(self, body):
+        prompt = json.loads(body or b"{}").get("prompt", "")
+        if "nutrition" in prompt:
+            return self._json({"response": NUTRITION_FACTS})
+        title = f"Bench Dish {uuid.uuid4().hex[:8]}"
+        answer = f"{title};A quick benchmark dish;rice,beans,salt;Cook the rice,Add the beans;a bowl of rice and beans"
+        return self._json({"response": answer})
+
+    def _pollinations(self, body):
+        return self._send(200, "image/png", self.image_bytes)
+
+    def _image(self, body):
+        return self._send(200, "image/jpeg", self.image_bytes)
+
+    def _vision(self, body):
+        return self._json({"text": f"Scanned Dish {uuid.uuid4().hex[:8]};Seen in a photo;tomato,basil;Slice|Serve"})
+
+    def _dailymed(self, body):
+        return self._json({"data": [{"title": "BENCH TABLETS 10MG", "setid": str(uuid.uuid4())}]})
+
+    def _spotify(self, body):
+        if self.path.endswith("/token"):
+            return self._json({"access_token": "bench-token"})
+        items = [{"name": f"Episode {i}", "id": uuid.uuid4().hex} for i in range(50)]
+        return self._json({"items": items, "next": None})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def start_stub(kind, config, host="127.0.0.1", port=0):
+    image_format = {"pollinations": "PNG", "image": "JPEG"}.get(kind)
+    handler = type(f"{kind.title()}Handler", (StubHandler,), {
+        "kind": kind,
+        "config": config,
+        "image_bytes": make_image(config.payload_kb, image_format) if image_format else b"",
+    })
+    server = StubServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name=f"stub-{kind}", daemon=True).start()
+    return server
+
+
+def start_all(configs, host="127.0.0.1"):
+    servers = {kind: start_stub(kind, configs[kind], host) for kind in UPSTREAMS}
+    urls = {kind: f"http://{host}:{s.server_port}" for kind, s in servers.items()}
+    return servers, urls
+
+
+def app_env(urls):
+    """Environment that points the app at the stubs."""
+    return {
+        "TEXT_WORKER_URL": urls["text"],
+        "POLLINATIONS_URL": urls["pollinations"] + "/prompt/",
+        "WORKER_URL": urls["image"],
+        "VISION_WORKER_URL": urls["vision"],
+        "DAILY_MED_URL": urls["dailymed"] + "/dailymed/services/v2/spls.json",
+        "SPOTIFY_TOKEN_URL": urls["spotify"] + "/api/token",
+        "SPOTIFY_API_URL": urls["spotify"] + "/v1",
+        "SPOTIFY_CLIENT_ID": "bench",
+        "SPOTIFY_CLIENT_SECRET": "bench",
+    }
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def add_stub_args(parser):
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mean upstream latency")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency spread as a fraction of the mean")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of upstream calls that return 500")
+    parser.add_argument("--payload-kb", type=int, default=64, help="approximate generated image size")
+    parser.add_argument("--set", action="append", default=[], metavar="UPSTREAM.FIELD=VALUE",
+                        help="per-upstream override, e.g. text.latency_ms=1500")
+
+
+def configs_from_args(args):
+    configs = {
+        kind: StubConfig(args.latency_ms, args.jitter, args.failure_rate, args.payload_kb)
+        for kind in UPSTREAMS
+    }
+    for override in args.set:
+        target, value = override.split("=", 1)
+        kind, field = target.split(".", 1)
+        if kind not in configs or not hasattr(configs[kind], field):
+            raise SystemExit(f"Unknown stub override '{override}'")
+        setattr(configs[kind], field, type(getattr(configs[kind], field))(value))
+    return configs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_stub_args(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    _, urls = start_all(configs_from_args(args), args.host)
+    print(json.dumps(urls), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""Latency histograms, spans and a runtime-switchable sampling profiler.
+
+Everything is kept in-process and rendered in the Prometheus text format
+by the /metrics route. Under several gunicorn workers each process keeps
+its own numbers, so scrape each worker or run one worker per container.
+"""
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from functools import wraps
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for n, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{n}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# -----------------------------
+# METRIC TYPES
+# -----------------------------
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, ([*s[0]], s[1], s[2])) for k, s in self._series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                labels = _label_str(self.labels + ("le",), key + (_fmt(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_str(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_fmt(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = _Tally()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_label_str(self.labels, key)} {_fmt(value)}")
+        return lines
+
+
+def render_family(name, metric_type, help_text, samples):
+    """Render values gathered at scrape time; samples are (labels dict, value)."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        names = tuple(labels)
+        lines.append(f"{name}{_label_str(names, tuple(labels[n] for n in names))} {_fmt(value)}")
+    return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "foodgen_request_seconds", "Time spent serving HTTP requests.", ["method", "endpoint", "status"]
+)
+SPANS = {
+    "upstream": Histogram("foodgen_upstream_seconds", "Time spent in outbound calls.", ["upstream"]),
+    "stage": Histogram("foodgen_stage_seconds", "Time spent in request processing stages.", ["stage"]),
+    "db": Histogram("foodgen_db_query_seconds", "Time spent in database queries.", ["query"]),
+}
+SPAN_LABELS = {"upstream": "upstream", "stage": "stage", "db": "query"}
+SPAN_ERRORS = Counter("foodgen_span_errors_total", "Spans that ended with an exception.", ["kind", "name"])
+
+_collectors = []
+
+
+@contextmanager
+def span(kind, name):
+    """Time a block as an upstream call, a processing stage or a DB query."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SPAN_ERRORS.inc(kind=kind, name=name)
+        raise
+    finally:
+        SPANS[kind].observe(time.perf_counter() - start, **{SPAN_LABELS[kind]: name})
+
+
+def timed_query(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span("db", name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_request(method, endpoint, status, seconds):
+    REQUEST_SECONDS.observe(seconds, method=method, endpoint=endpoint, status=status)
+
+
+def register_collector(fn):
+    # fn() returns a list of already rendered lines, called on every scrape
+    _collectors.append(fn)
+    return fn
+
+
+def render():
+    lines = REQUEST_SECONDS.render()
+    for histogram in SPANS.values():
+        lines += histogram.render()
+    lines += SPAN_ERRORS.render()
+    for collect in _collectors:
+        lines += collect()
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------
+# SAMPLING PROFILER
+# -----------------------------
+class SamplingProfiler:
+    """Periodically samples every thread's stack while running.
+
+    Stacks are kept in collapsed form ("outer;inner;leaf count"), which
+    flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stacks = _Tally()
+        self._thread = None
+        self._stop = threading.Event()
+        self.interval = 0.01
+        self.samples = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=0.01):
+        with self._lock:
+            if self.running:
+                return
+            self.interval = interval
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            collapsed = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                collapsed.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(collapsed)
+                self.samples += 1
+
+    def collapsed(self):
+        with self._lock:
+            items = self._stacks.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in items) + "\n"
+
+
+profiler = SamplingProfiler()
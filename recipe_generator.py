@@ -1,20 +1,85 @@
+import asyncio
 import os
 import requests
 import uuid
 from PIL import Image
 
-TEXT_WORKER_URL = "https://kidslearninglab-text-only.nameless-cherry-998c.workers.dev"
+import httpx
+
+from admission import LIMITERS, AdmissionRefused, BULK
+from metrics import span
+
+TEXT_WORKER_URL = os.getenv("TEXT_WORKER_URL", "https://kidslearninglab-text-only.nameless-cherry-998c.workers.dev")
+POLLINATIONS_URL = os.getenv("POLLINATIONS_URL", "https://image.pollinations.ai/prompt/")
+# Pollinations has no admission limit, so bound how long and how many of its
+# calls may hang instead
+POLLINATIONS_TIMEOUT = float(os.getenv("POLLINATIONS_TIMEOUT", 120))
+POLLINATIONS_MAX_CONNECTIONS = int(os.getenv("POLLINATIONS_MAX_CONNECTIONS", 64))
 
 # -----------------------------
 # CORE TEXT CALL
 # -----------------------------
-def get_response(prompt):
+def get_response(prompt, priority=BULK):
     try:
-        response = requests.post(
-            TEXT_WORKER_URL,
-            json={"prompt": prompt},
-            timeout=30
+        with LIMITERS["text"].slot(priority), span("upstream", "text"):
+            response = requests.post(
+                TEXT_WORKER_URL,
+                json={"prompt": prompt},
+                timeout=30
+            )
+        response.raise_for_status()
+
+        data = response.json()
+
+        if "response" not in data:
+            return ""
+
+        return data["response"].strip()
+
+    except AdmissionRefused:
+        raise
+    except Exception:
+        return ""
+
+
+# -----------------------------
+# ASYNC HTTP CLIENT
+# -----------------------------
+_async_clients = {}
+
+
+def _pooled_client(name, timeout, max_connections):
+    client = _async_clients.get(name)
+    if client is None or client.is_closed:
+        client = _async_clients[name] = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=100),
         )
+    return client
+
+
+def async_client():
+    # One pooled client per process so hundreds of calls can share connections
+    return _pooled_client("default", 30, 500)
+
+
+def pollinations_client():
+    # A separate pool, so stalled Pollinations renders can't starve the workers
+    return _pooled_client("pollinations", POLLINATIONS_TIMEOUT, POLLINATIONS_MAX_CONNECTIONS)
+
+
+async def close_async_client():
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+async def get_response_async(prompt, priority=BULK):
+    try:
+        async with LIMITERS["text"].async_slot(priority):
+            with span("upstream", "text"):
+                response = await async_client().post(TEXT_WORKER_URL, json={"prompt": prompt})
         response.raise_for_status()
 
         data = response.json()
@@ -24,6 +89,8 @@ def get_response(prompt):
 
         return data["response"].strip()
 
+    except AdmissionRefused:
+        raise
     except Exception:
         return ""
 
@@ -31,22 +98,24 @@ def get_response(prompt):
 # -----------------------------
 # IMAGE GENERATION (UNCHANGED)
 # -----------------------------
-def get_image_pollinations(prompt, save_path="generated_images.png"):
+def pollinations_url(prompt):
     prompt += str(uuid.uuid4())
     formatted_prompt = prompt.replace(" ", "-")
-    url = f"https://image.pollinations.ai/prompt/{formatted_prompt}"
+    return f"{POLLINATIONS_URL}{formatted_prompt}"
+
+
+def get_image_pollinations(prompt, save_path="generated_images.png"):
+    url = pollinations_url(prompt)
 
     try:
-        response = requests.get(url)
+        with span("upstream", "pollinations"):
+            response = requests.get(url, timeout=POLLINATIONS_TIMEOUT)
         response.raise_for_status()
 
         if "image" not in response.headers.get("Content-Type", ""):
             return None
 
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        with open(save_path, 'wb') as f:
-            f.write(response.content)
-
+        write_file(save_path, response.content)
         return save_path
     except Exception:
         return None
@@ -54,15 +123,16 @@ def get_image_pollinations(prompt, save_path="generated_images.png"):
 
 def crop_bottom(image_path, pixels_to_crop=60):
     try:
-        img = Image.open(image_path)
-        width, height = img.size
+        with span("stage", "crop_bottom"):
+            img = Image.open(image_path)
+            width, height = img.size
 
-        if height <= pixels_to_crop:
-            return None
+            if height <= pixels_to_crop:
+                return None
 
-        cropped_img = img.crop((0, 0, width, height - pixels_to_crop))
-        cropped_img.save(image_path)
-        return cropped_img
+            cropped_img = img.crop((0, 0, width, height - pixels_to_crop))
+            cropped_img.save(image_path)
+            return cropped_img
     except Exception:
         return None
 
@@ -70,11 +140,45 @@ def crop_bottom(image_path, pixels_to_crop=60):
 crop_bottom_pixels = crop_bottom
 
 
+async def get_image_pollinations_async(prompt, save_path="generated_images.png"):
+    url = pollinations_url(prompt)
+
+    try:
+        with span("upstream", "pollinations"):
+            response = await pollinations_client().get(url, follow_redirects=True)
+        response.raise_for_status()
+
+        if "image" not in response.headers.get("Content-Type", ""):
+            return None
+
+        await asyncio.to_thread(write_file, save_path, response.content)
+        return save_path
+    except Exception:
+        return None
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+async def crop_bottom_async(image_path, pixels_to_crop=60):
+    # PIL work is CPU-bound, keep it off the event loop
+    return await asyncio.to_thread(crop_bottom, image_path, pixels_to_crop)
+
+
+async def post_worker_async(url, limiter, priority=BULK, **kwargs):
+    async with LIMITERS[limiter].async_slot(priority):
+        with span("upstream", limiter):
+            return await async_client().post(url, **kwargs)
+
+
 # -----------------------------
 # RECIPE GENERATION
 # -----------------------------
-def get_recipe(ingredients, budget, serves, time, meal_type):
-    prompt = f"""You are a recipe generator. Generate exactly one string with five fields in this order, separated strictly by semicolons ;:
+def build_recipe_prompt(ingredients, budget, serves, time, meal_type):
+    return f"""You are a recipe generator. Generate exactly one string with five fields in this order, separated strictly by semicolons ;:
 
 title;description;ingredients;procedures;imagedescription
 
@@ -96,38 +200,67 @@ Time: {time}
 Meal type: {meal_type}
 """
 
-    answer_text = get_response(prompt)
 
+def parse_recipe_answer(answer_text):
     if not answer_text:
-        return ["0", "0", "0", "0", "0"]
+        return None
 
     parts = answer_text.split(";")
 
     if len(parts) < 5:
-        return ["0", "0", "0", "0", "0"]
+        return None
+
+    return [p.strip() for p in parts[:5]]
 
-    title = parts[0].strip()
-    desc = parts[1].strip()
-    ing = parts[2].strip()
-    procedures = parts[3].strip()
-    image_desc = parts[4].strip()
 
+def recipe_image_path(title):
     safe_title = title.replace(" ", "_")
     save_folder = f"images/{safe_title}"
     os.makedirs(save_folder, exist_ok=True)
-    image_path = f"{save_folder}/image.png"
+    return f"{save_folder}/image.png"
 
+
+def get_recipe_text(ingredients, budget, serves, time, meal_type, priority=BULK):
+    prompt = build_recipe_prompt(ingredients, budget, serves, time, meal_type)
+    return parse_recipe_answer(get_response(prompt, priority))
+
+
+def render_recipe_image(title, image_desc):
+    image_path = recipe_image_path(title)
     get_image_pollinations(image_desc, image_path)
     crop_bottom_pixels(image_path, 60)
+    return image_path
+
+
+def get_recipe(ingredients, budget, serves, time, meal_type, priority=BULK):
+    parsed = get_recipe_text(ingredients, budget, serves, time, meal_type, priority)
+
+    if parsed is None:
+        return ["0", "0", "0", "0", "0"]
+
+    title, desc, ing, procedures, image_desc = parsed
+    image_path = render_recipe_image(title, image_desc)
 
     return [title, desc, ing, procedures, image_desc, image_path]
 
 
+async def get_recipe_text_async(ingredients, budget, serves, time, meal_type, priority=BULK):
+    prompt = build_recipe_prompt(ingredients, budget, serves, time, meal_type)
+    return parse_recipe_answer(await get_response_async(prompt, priority))
+
+
+async def render_recipe_image_async(title, image_desc):
+    image_path = recipe_image_path(title)
+    await get_image_pollinations_async(image_desc, image_path)
+    await crop_bottom_async(image_path, 60)
+    return image_path
+
+
 # -----------------------------
 # NUTRITION FACTS
 # -----------------------------
-def get_nutrition_facts(recipe_text):
-    prompt = f"""
+def nutrition_prompt(recipe_text):
+    return f"""
 Analyze this recipe and estimate nutrition facts.
 Return exactly:
 
@@ -138,7 +271,14 @@ No explanation. No ranges.
 Recipe:
 {recipe_text}
 """
-    return get_response(prompt)
+
+
+def get_nutrition_facts(recipe_text):
+    return get_response(nutrition_prompt(recipe_text))
+
+
+async def get_nutrition_facts_async(recipe_text):
+    return await get_response_async(nutrition_prompt(recipe_text))
 
 
 # -----------------------------
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+
+
+# -----------------------------
+# REQUEST COALESCING
+# -----------------------------
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into one upstream call.
+
+    The first caller for a key runs the function; everyone who arrives while
+    it is still running waits and gets the same result (or exception).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": in_flight}
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines running on one event loop."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield so one cancelled waiter doesn't cancel the shared call
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(fn(*args, **kwargs))
+        self._calls[key] = future
+        future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def _get_group(cls, name):
+    with _groups_lock:
+        if (cls, name) not in _groups:
+            _groups[(cls, name)] = cls(name)
+        return _groups[(cls, name)]
+
+
+def group(name):
+    return _get_group(SingleFlight, name)
+
+
+def async_group(name):
+    return _get_group(AsyncSingleFlight, name)
+
+
+def all_stats():
+    # Sync and async groups with the same name report as one
+    with _groups_lock:
+        groups = list(_groups.values())
+    totals = {}
+    for g in groups:
+        merged = totals.setdefault(g.name, {"calls": 0, "coalesced": 0, "in_flight": 0})
+        for k, v in g.stats().items():
+            merged[k] += v
+    return totals
+
+
+def normalize_key(*parts):
+    # Whitespace differences shouldn't defeat coalescing
+    return tuple(" ".join(str(p).split()) for p in parts)
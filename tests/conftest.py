@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+# app and storage create their tables on import; point them at a scratch
+# database before any test module imports them
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="foodgen-tests-"), "import.db")
+
+import pytest
+
+import storage
+
+# Storage tests also run against Postgres when this is set, e.g.
+# TEST_POSTGRES_URL=postgresql+psycopg2://postgres@localhost/foodgen_test
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def db(request, tmp_path, monkeypatch):
+    """A freshly reset database; yields its URL."""
+    if request.param == "postgres":
+        if not POSTGRES_URL:
+            pytest.skip("TEST_POSTGRES_URL not set")
+        url = POSTGRES_URL
+    else:
+        url = f"sqlite:///{tmp_path / 'test.db'}"
+
+    engine = storage.make_engine(url)
+    monkeypatch.setattr(storage, "engine", engine)
+    storage.reset_db()
+    yield url
+    engine.dispose()
+
+
+@pytest.fixture
+def client(db):
+    from app import app
+    return app.test_client()
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from admission import BULK, INTERACTIVE, QuotaExceeded, UpstreamBusy, UpstreamLimiter
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def queue_thread(limiter, priority, order, name):
+    def run():
+        with limiter.slot(priority):
+            order.append(name)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_interactive_jumps_the_bulk_queue():
+    limiter = UpstreamLimiter("test", daily_quota=100, max_concurrent=1)
+    order = []
+    limiter.acquire()
+
+    threads = [queue_thread(limiter, BULK, order, "bulk-1")]
+    wait_until(lambda: limiter.stats()["queued"] == 1)
+    threads.append(queue_thread(limiter, BULK, order, "bulk-2"))
+    wait_until(lambda: limiter.stats()["queued"] == 2)
+    threads.append(queue_thread(limiter, INTERACTIVE, order, "interactive"))
+    wait_until(lambda: limiter.stats()["queued"] == 3)
+
+    limiter.release()
+    for thread in threads:
+        thread.join(2)
+
+    assert order == ["interactive", "bulk-1", "bulk-2"]
+    assert limiter.stats()["active"] == 0
+
+
+def test_quota_is_refused_at_the_limit():
+    limiter = UpstreamLimiter("test", daily_quota=2, max_concurrent=4)
+    limiter.acquire()
+    limiter.acquire()
+
+    with pytest.raises(QuotaExceeded) as refused:
+        limiter.acquire()
+
+    assert refused.value.status_code == 429
+    assert refused.value.retry_after >= 1
+    assert limiter.stats()["used_today"] == 2
+
+
+def test_quota_counts_queued_requests():
+    # One running and one queued already spend a quota of 2
+    limiter = UpstreamLimiter("test", daily_quota=2, max_concurrent=1)
+    limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire)
+    waiter.start()
+    wait_until(lambda: limiter.stats()["queued"] == 1)
+
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire()
+
+    limiter.release()
+    waiter.join(2)
+    assert limiter.stats()["used_today"] == 2
+
+
+def test_quota_resets_at_utc_midnight():
+    limiter = UpstreamLimiter("test", daily_quota=1, max_concurrent=1)
+    limiter.acquire()
+    limiter.release()
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire()
+
+    limiter._reset_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    limiter.acquire()
+
+    assert limiter.stats()["used_today"] == 1
+
+
+def test_full_queue_is_refused_immediately():
+    limiter = UpstreamLimiter("test", daily_quota=100, max_concurrent=1, max_queue=0)
+    limiter.acquire()
+
+    with pytest.raises(UpstreamBusy) as refused:
+        limiter.acquire()
+
+    assert refused.value.status_code == 503
+
+
+def test_wait_times_out_and_leaves_the_queue():
+    limiter = UpstreamLimiter("test", daily_quota=100, max_concurrent=1, max_wait=0.05)
+    limiter.acquire()
+
+    with pytest.raises(UpstreamBusy):
+        limiter.acquire()
+
+    stats = limiter.stats()
+    assert stats["queued"] == 0
+    assert stats["active"] == 1
+    assert stats["used_today"] == 1
+
+
+def test_exhaust_backs_off_for_a_bounded_time():
+    limiter = UpstreamLimiter("test", daily_quota=100, max_concurrent=1, exhaust_seconds=0.05)
+    limiter.exhaust()
+
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire()
+    assert limiter.stats()["exhausted"]
+
+    time.sleep(0.06)
+    limiter.acquire()
+    assert not limiter.stats()["exhausted"]
+
+
+def test_async_waiter_is_woken_by_a_sync_release():
+    limiter = UpstreamLimiter("test", daily_quota=100, max_concurrent=1)
+
+    async def scenario():
+        limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire_async(INTERACTIVE))
+        while limiter.stats()["queued"] == 0:
+            await asyncio.sleep(0.005)
+        threading.Timer(0.02, limiter.release).start()
+        await asyncio.wait_for(waiter, 2)
+
+    asyncio.run(scenario())
+    assert limiter.stats()["active"] == 1
+    assert limiter.stats()["queued"] == 0
+
+
+def test_async_timeout_cleans_up():
+    limiter = UpstreamLimiter("test", daily_quota=100, max_concurrent=1, max_wait=0.05)
+    limiter.acquire()
+
+    with pytest.raises(UpstreamBusy):
+        asyncio.run(limiter.acquire_async())
+
+    assert limiter.stats()["queued"] == 0
+    assert limiter._async_wakers == {}
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    limiter = UpstreamLimiter("test", daily_quota=100, max_concurrent=1)
+
+    async def scenario():
+        limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        while limiter.stats()["queued"] == 0:
+            await asyncio.sleep(0.005)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(scenario())
+    assert limiter.stats()["queued"] == 0
+    assert limiter._async_wakers == {}
+
+    # The slot still goes to the next caller once freed
+    limiter.release()
+    limiter.acquire()
+    assert limiter.stats()["active"] == 1
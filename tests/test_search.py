@@ -0,0 +1,129 @@
+import pytest
+from sqlalchemy import text
+
+import storage
+
+
+def add(user_id, title, description="", ingredients="", procedures=""):
+    return storage.save_recipe(user_id, title, description, ingredients, procedures, "", "")
+
+
+def titles(response):
+    return [r["title"] for r in response.json["recipes"]]
+
+
+def test_title_hit_ranks_above_description_hit(client):
+    add("u", "Weeknight Dinner", "a bowl of lentil soup")
+    add("u", "Lentil Stew", "hearty and warm")
+
+    response = client.get("/search_recipes", query_string={"q": "lentil"})
+
+    assert response.status_code == 200
+    assert titles(response) == ["Lentil Stew", "Weeknight Dinner"]
+    scores = [r["score"] for r in response.json["recipes"]]
+    assert scores[0] > scores[1]
+
+
+def test_only_the_last_term_is_a_prefix(client):
+    add("u", "Chickpea Curry")
+
+    assert titles(client.get("/search_recipes", query_string={"q": "curry chick"})) == ["Chickpea Curry"]
+    assert titles(client.get("/search_recipes", query_string={"q": "chick curry"})) == []
+
+
+def test_limit_and_offset_are_clamped(client):
+    for i in range(3):
+        add("u", f"Rice Bowl {i}")
+
+    response = client.get("/search_recipes", query_string={"q": "rice", "limit": 0, "offset": -5})
+    assert response.json["limit"] == 1
+    assert response.json["offset"] == 0
+    assert response.json["total"] == 3
+    assert len(response.json["recipes"]) == 1
+
+    response = client.get("/search_recipes", query_string={"q": "rice", "limit": 1000, "offset": 2})
+    assert response.json["limit"] == 100
+    assert len(response.json["recipes"]) == 1
+
+
+@pytest.mark.parametrize("params", [{"limit": "ten"}, {"offset": "1.5"}])
+def test_non_integer_paging_is_rejected(client, params):
+    response = client.get("/search_recipes", query_string={"q": "rice", **params})
+    assert response.status_code == 400
+
+
+def test_missing_query_is_rejected(client):
+    assert client.get("/search_recipes", query_string={"q": "  "}).status_code == 400
+
+
+def test_user_id_scopes_the_search(client):
+    add("alice", "Alice Rice")
+    add("bob", "Bob Rice")
+
+    response = client.get("/search_recipes", query_string={"q": "rice", "user_id": "alice"})
+    assert titles(response) == ["Alice Rice"]
+    assert response.json["total"] == 1
+
+    response = client.get("/search_recipes", query_string={"q": "rice"})
+    assert sorted(titles(response)) == ["Alice Rice", "Bob Rice"]
+
+
+@pytest.mark.parametrize("query", ['"', '"rice', "rice AND", "NOT rice", "rice OR beans*", "(rice)", "rice:*"])
+def test_query_syntax_is_treated_as_words(client, query):
+    add("u", "Not Your Usual Rice")
+
+    response = client.get("/search_recipes", query_string={"q": query})
+
+    assert response.status_code == 200
+
+
+def test_operators_are_matched_literally(client):
+    add("u", "Not Your Usual Rice")
+    add("u", "Plain Beans")
+
+    # NOT is a word here, not an operator excluding rice
+    assert titles(client.get("/search_recipes", query_string={"q": "NOT rice"})) == ["Not Your Usual Rice"]
+
+
+@pytest.mark.parametrize("terms", [
+    ['"'], ["NOT"], ["*"], ["a'b"], ["a\\b"], ["rice", "&", "|"], ["rice", "!", ":"],
+])
+def test_storage_accepts_raw_terms(db, terms):
+    add("u", "Rice")
+    total, rows = storage.search_recipes(terms)
+    assert total == len(rows)
+
+
+def test_index_follows_inserts_updates_and_deletes(db):
+    add("u", "Tomato Soup")
+    assert storage.search_recipes(["tomato"])[0] == 1
+
+    with storage.engine.begin() as conn:
+        conn.execute(text("UPDATE recipes SET title = 'Pumpkin Soup' WHERE title = 'Tomato Soup'"))
+    assert storage.search_recipes(["tomato"])[0] == 0
+    assert storage.search_recipes(["pumpkin"])[0] == 1
+
+    with storage.engine.begin() as conn:
+        conn.execute(text("DELETE FROM recipes WHERE title = 'Pumpkin Soup'"))
+    assert storage.search_recipes(["pumpkin"])[0] == 0
+    assert storage.search_recipes(["soup"])[0] == 0
+
+
+def test_init_db_indexes_recipes_stored_before_search_existed(tmp_path, monkeypatch):
+    # The schema as it was before full-text search was added
+    engine = storage.make_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE users (id TEXT PRIMARY KEY)"))
+        conn.execute(text(
+            "CREATE TABLE recipes (user_id TEXT, title TEXT, description TEXT, ingredients TEXT, "
+            "procedures TEXT, image_prompt TEXT, image_path TEXT)"
+        ))
+        conn.execute(text("INSERT INTO recipes (user_id, title, description) VALUES ('u', 'Old Gumbo', 'from before')"))
+    monkeypatch.setattr(storage, "engine", engine)
+
+    storage.init_db()
+
+    total, rows = storage.search_recipes(["gumbo"])
+    assert total == 1
+    assert rows[0][0] == "Old Gumbo"
+    engine.dispose()
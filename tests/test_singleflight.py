@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight, all_stats, async_group, group, normalize_key
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+def run_concurrently(flight, n, fn):
+    results = [None] * n
+
+    def call(i):
+        try:
+            results[i] = flight.do("key", fn)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        release.wait(2)
+        return {"answer": 42}
+
+    threads, results = run_concurrently(flight, 8, upstream)
+    wait_until(lambda: flight.coalesced == 7)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert len(calls) == 1
+    assert all(r == {"answer": 42} for r in results)
+    assert flight.stats() == {"calls": 1, "coalesced": 7, "in_flight": 0}
+
+
+def test_leader_exception_reaches_followers():
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def upstream():
+        release.wait(2)
+        raise ValueError("upstream down")
+
+    threads, results = run_concurrently(flight, 4, upstream)
+    wait_until(lambda: flight.coalesced == 3)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert all(isinstance(r, ValueError) and str(r) == "upstream down" for r in results)
+
+
+def test_key_is_released_after_completion():
+    flight = SingleFlight("test")
+    calls = []
+
+    assert flight.do("key", lambda: calls.append(1) or len(calls)) == 1
+    assert flight.stats()["in_flight"] == 0
+    assert flight.do("key", lambda: calls.append(1) or len(calls)) == 2
+
+    def failing():
+        raise ValueError("upstream down")
+
+    with pytest.raises(ValueError):
+        flight.do("key", failing)
+    assert flight.stats()["in_flight"] == 0
+    assert flight.do("key", lambda: "after error") == "after error"
+
+
+def test_async_callers_share_one_call():
+    flight = AsyncSingleFlight("test")
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def scenario():
+        return await asyncio.gather(*[flight.do("key", upstream) for _ in range(8)])
+
+    assert asyncio.run(scenario()) == ["done"] * 8
+    assert len(calls) == 1
+    assert flight.stats() == {"calls": 1, "coalesced": 7, "in_flight": 0}
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call():
+    flight = AsyncSingleFlight("test")
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def upstream():
+            await gate.wait()
+            return "done"
+
+        leader = asyncio.ensure_future(flight.do("key", upstream))
+        follower = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        # Cancelling either caller leaves the call running for the other
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        gate.set()
+        return await follower
+
+    assert asyncio.run(scenario()) == "done"
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_all_stats_merges_sync_and_async_groups():
+    group("test-merge").do("key", lambda: 1)
+
+    async def upstream():
+        return 1
+
+    asyncio.run(async_group("test-merge").do("key", upstream))
+
+    assert all_stats()["test-merge"] == {"calls": 2, "coalesced": 0, "in_flight": 0}
+
+
+def test_normalize_key_ignores_whitespace():
+    assert normalize_key("  two\n eggs ") == normalize_key("two eggs")
+
+
+def test_conjugate_requests_share_one_conjugation(monkeypatch):
+    import app
+
+    real_conjugate = app.conjugator.conjugate
+    release = threading.Event()
+    calls = []
+
+    def conjugate(verb):
+        calls.append(verb)
+        release.wait(2)
+        return real_conjugate(verb)
+
+    monkeypatch.setattr(app.conjugator, "conjugate", conjugate, raising=False)
+    before = app.flight_group("conjugate").coalesced
+    responses = [None] * 4
+
+    def request(i):
+        responses[i] = app.app.test_client().get("/conjugate", query_string={"verb": " Tener ", "tense": "present"})
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: app.flight_group("conjugate").coalesced - before == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == ["tener"]
+    assert all(r.status_code == 200 for r in responses)
+    assert responses[0].json["conjugations"]["yo"] == "tengo"
+
+
+@pytest.mark.parametrize("tense, yo", [
+    ("present", "tengo"), ("preterite", "tuve"), ("imperfect", "tenía"),
+    ("future", "tendré"), ("conditional", "tendría"), ("subjunctive", "tenga"),
+])
+def test_conjugate_every_tense(tense, yo):
+    import app
+
+    response = app.app.test_client().get("/conjugate", query_string={"verb": "tener", "tense": tense})
+    assert response.status_code == 200
+    assert response.json["conjugations"]["yo"] == yo
@@ -0,0 +1,105 @@
+import multiprocessing
+import threading
+
+import pytest
+from sqlalchemy import text
+
+import storage
+
+
+def add(user_id, title, image_path=""):
+    return storage.save_recipe(user_id, title, "desc", "rice,beans", "cook", "prompt", image_path)
+
+
+def test_duplicate_titles_get_numbered(db):
+    assert [add("u", "Soup") for _ in range(3)] == ["Soup", "Soup (1)", "Soup (2)"]
+    # Titles are unique per user, not globally
+    assert add("other", "Soup") == "Soup"
+
+
+def test_free_suffix_is_reused(db):
+    add("u", "Stew")
+    add("u", "Stew (2)")
+    assert add("u", "Stew") == "Stew (1)"
+
+
+@pytest.mark.parametrize("title, lookalike", [
+    ("100% Juice", "100X Juice (1)"),
+    ("a_b", "axb (1)"),
+    ("C:\\Dish", "C:Dish (1)"),
+])
+def test_like_wildcards_in_titles_are_literal(db, title, lookalike):
+    add("u", lookalike)
+    assert add("u", title) == title
+    assert add("u", title) == f"{title} (1)"
+    assert add("u", title) == f"{title} (2)"
+
+
+def test_save_recipes_bulk_inserts(db):
+    count = storage.save_recipes([
+        {"user_id": "u", "title": "Bulk Rice", "image_path": "images/a.jpg"},
+        {"user_id": "u", "title": "Bulk Rice", "description": "stored as given"},
+        {"user_id": "v", "title": "Bulk Beans"},
+    ])
+
+    assert count == 3
+    rows = storage.get_recipes("u")
+    assert [r[0] for r in rows] == ["Bulk Rice", "Bulk Rice"]
+    assert rows[0][5] == "images/a.jpg"
+    assert rows[0][1] is None
+    assert storage.search_recipes(["bulk"])[0] == 3
+    assert storage.save_recipes([]) == 0
+
+
+def test_reset_db_empties_every_table(db):
+    add("u", "Soup")
+    with storage.engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id) VALUES ('7')"))
+
+    storage.reset_db()
+
+    assert storage.get_recipes("u") == []
+    assert storage.get_all_titles() == []
+    assert storage.search_recipes(["soup"]) == (0, [])
+    assert storage.get_next_user_id() == 1
+    assert add("u", "Soup") == "Soup"
+
+
+def test_lookups_follow_insertion_order(db):
+    for title in ("Zucchini Bake", "Apple Tart", "Mango Salad"):
+        add("u", title, f"images/{title}.jpg")
+    add("v", "Apple Tart", "images/other.jpg")
+
+    assert [r[0] for r in storage.get_recipes("u")] == ["Zucchini Bake", "Apple Tart", "Mango Salad"]
+    assert storage.get_image_path("v", "Apple Tart")[0] == "images/other.jpg"
+    assert storage.get_image_path_by_title("Apple Tart")[0] == "images/Apple Tart.jpg"
+    assert storage.get_image_path("u", "Missing") is None
+
+
+def test_in_memory_database_is_shared_between_threads(monkeypatch):
+    engine = storage.make_engine("sqlite://")
+    monkeypatch.setattr(storage, "engine", engine)
+    storage.init_db()
+    add("u", "Soup")
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(storage.get_recipes("u")))
+    thread.start()
+    thread.join(5)
+
+    assert [r[0] for r in result[0]] == ["Soup"]
+
+
+def _save_same_title(url, count):
+    storage.engine = storage.make_engine(url)
+    return [add("u", "Dish") for _ in range(count)]
+
+
+def test_titles_stay_unique_across_processes(db):
+    # Separate processes, so only a database-level lock can keep them apart
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        batches = pool.starmap(_save_same_title, [(db, 10)] * 4)
+
+    titles = [t for batch in batches for t in batch]
+    assert len(set(titles)) == 40
+    assert sorted(storage.get_all_titles()) == sorted(titles)